@@ -0,0 +1,84 @@
+import os, sys, json, time, sqlite3, argparse, tempfile, subprocess
+from run_benchmark import benchmark_env, repo_path
+from stub_providers import start_stub_server
+
+# Burst test for single-flight (request coalescing). Several worker processes, each with several threads, ask for the weather, forecast and
+# attractions of the same few uncached cities at the same moment. This is run once with SINGLE_FLIGHT=0 and once with SINGLE_FLIGHT=1, each time
+# with an empty database, and reports how many upstream API calls were made and how many duplicate weather rows were written.
+#
+#   python benchmarks/burst_benchmark.py --processes 4 --threads 16 --cities 2 --latency-ms 100
+
+# Runs in each worker process: wait until start_at, then make every thread do a chat turn's lookups for one of the cities.
+burst_code = """
+import sys, json, time, threading
+import main
+start_at, threads, cities = float(sys.argv[1]), int(sys.argv[2]), sys.argv[3].split(",")
+main.app.config["API_DAILY_LIMITS"] = {provider: 10 ** 9 for provider in main.app.config["API_DAILY_LIMITS"]}
+errors = []
+def lookups(i):
+    city = cities[i % len(cities)]
+    with main.app.app_context():
+        try:
+            main.fetch_weather(city)
+            main.fetch_5day_forecast(city)
+            main.fetch_attractions(*main.geocode_city(city))
+        except Exception as e:
+            errors.append(repr(e))
+workers = [threading.Thread(target=lookups, args=(i,)) for i in range(threads)]
+time.sleep(max(0, start_at - time.time()))
+for worker in workers:
+    worker.start()
+for worker in workers:
+    worker.join()
+print(json.dumps({"errors": len(errors), "first_error": errors[0] if errors else None}))
+"""
+
+# Run one burst and return the upstream calls, duplicate rows and errors.
+def run_burst(single_flight, args):
+    stub = start_stub_server(latency_ms=args.latency_ms)
+    db_dir = tempfile.mkdtemp(prefix="weatherbot-burst-")
+    env = dict(benchmark_env(stub.url, db_dir), SINGLE_FLIGHT="1" if single_flight else "0")
+    subprocess.run([sys.executable, "-c", "import main"], env=env, cwd=repo_path, check=True)     # Create the tables first, so the workers don't race to.
+    cities = ",".join(f"burstcity{i}" for i in range(args.cities))
+    start_at = time.time() + args.startup_seconds
+    workers = [subprocess.Popen([sys.executable, "-c", burst_code, str(start_at), str(args.threads), cities], env=env, cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+               for _ in range(args.processes)]
+    outputs = [worker.communicate() for worker in workers]
+    stub.shutdown()
+
+    errors, first_error = 0, None
+    for (stdout, stderr), worker in zip(outputs, workers):
+        if worker.returncode != 0:
+            errors += args.threads
+            first_error = first_error or (stderr.strip().splitlines() or ["failed"])[-1]
+            continue
+        result = json.loads(stdout.strip().splitlines()[-1])
+        errors += result["errors"]
+        first_error = first_error or result["first_error"]
+    with sqlite3.connect(os.path.join(db_dir, "benchmark.sqlite3")) as conn:
+        duplicate_rows = conn.execute("SELECT COUNT(*) - COUNT(DISTINCT city || '|' || date) FROM weather_data").fetchone()[0]
+    return {
+        "single_flight": single_flight,
+        "upstream_calls": dict(stub.request_counts),
+        "total_upstream_calls": sum(stub.request_counts.values()),
+        "duplicate_weather_rows": duplicate_rows,
+        "errors": errors,
+        "first_error": first_error
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare upstream API calls under a burst of identical requests with and without single-flight.")
+    parser.add_argument("--processes", type=int, default=4, help="Worker processes sharing the database.")
+    parser.add_argument("--threads", type=int, default=16, help="Concurrent requests in each process.")
+    parser.add_argument("--cities", type=int, default=2, help="Number of different cities the burst asks about.")
+    parser.add_argument("--latency-ms", type=float, default=100, help="Average latency of the stub providers.")
+    parser.add_argument("--startup-seconds", type=float, default=10, help="Time allowed for the workers to start before the burst.")
+    args = parser.parse_args()
+
+    for single_flight in [False, True]:
+        result = run_burst(single_flight, args)
+        print(f"single-flight {'on ' if single_flight else 'off'}  {result['total_upstream_calls']:>5} upstream calls {result['upstream_calls']}  "
+              f"{result['duplicate_weather_rows']} duplicate weather rows  {result['errors']} errors")
+        if result["first_error"]:
+            print(f"  first error: {result['first_error']}")
+    print(f"({args.processes} processes x {args.threads} requests, {args.cities} cities; an ideal run makes 4 calls per city: geocode, weather, forecast and places)")
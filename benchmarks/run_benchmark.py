@@ -0,0 +1,194 @@
+import os, sys, json, time, argparse, tempfile, threading, subprocess, statistics
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline benchmark for the weather chatbot. Starts the stub providers from stub_providers.py, points the app at them and a throwaway database,
+# then measures cold start (including ChatterBot training), the individual fetchers and full chat turns at a given concurrency.
+# Results are printed and saved as JSON (by default to benchmarks/results/<commit>.json) so they can be compared between commits.
+#
+#   python benchmarks/run_benchmark.py --iterations 200 --concurrency 8 --latency-ms 50
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+repo_path = os.path.dirname(benchmarks_path)
+sys.path.insert(0, benchmarks_path)
+sys.path.insert(0, repo_path)
+from stub_providers import start_stub_server
+
+# Environment that points main.py at the stub servers and a database in db_dir. Set before main is imported, as it reads these at import time.
+def benchmark_env(stub_url, db_dir):
+    database_url = "sqlite:///" + os.path.join(db_dir, "benchmark.sqlite3")
+    return dict(os.environ,
+        OPENWEATHER_URL=stub_url,
+        GEOAPIFY_URL=stub_url,
+        GOOGLE_MAPS_URL=stub_url,
+        MAP_CACHE_DIR=os.path.join(db_dir, "map_cache"),
+        LOCK_DIR=os.path.join(db_dir, "locks"),
+        OPENWEATHER_API_KEY="benchmark",
+        GOOGLE_API_KEY="benchmark",
+        GEOAPIFY_API_KEY="benchmark",
+        DATABASE_URL=database_url,
+        CHATBOT_DATABASE_URL=database_url
+    )
+
+# Time importing main.py and loading the chatbot in a fresh process. The first run trains the chatbot, the second should find the trained snapshot.
+cold_start_code = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+with main.app.app_context():
+    main.get_chatbot()
+print(json.dumps({"import_seconds": imported - start, "chatbot_seconds": time.perf_counter() - imported, "total_seconds": time.perf_counter() - start}))
+"""
+def measure_cold_start(env):
+    results = {}
+    for run in ["untrained", "trained"]:
+        output = subprocess.run([sys.executable, "-c", cold_start_code], env=env, cwd=repo_path, capture_output=True, text=True)
+        if output.returncode != 0:
+            results[run] = {"error": output.stderr.strip().splitlines()[-1] if output.stderr.strip() else "failed"}
+        else:
+            results[run] = json.loads(output.stdout.strip().splitlines()[-1])
+    return results
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else 0
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+# Count SQL statements run through any SQLAlchemy engine (both the app's and ChatterBot's).
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        with self.lock:
+            self.count += 1
+
+# Call func(i) for i in range(iterations) from `concurrency` threads and summarise the latencies, SQL queries and upstream calls.
+def run_scenario(func, iterations, concurrency, stub, queries):
+    latencies = []
+    errors = []
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            func(i)
+        except Exception as e:
+            errors.append(repr(e))
+        latencies.append(time.perf_counter() - start)
+    stub.reset_counts()
+    queries_before = queries.count
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(iterations)))
+    elapsed = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "throughput_per_second": round(iterations / elapsed, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "sql_queries": queries.count - queries_before,
+        "sql_queries_per_call": round((queries.count - queries_before) / iterations, 2),
+        "upstream_calls": dict(stub.request_counts),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None
+    }
+
+def git_commit():
+    output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_path, capture_output=True, text=True)
+    return output.stdout.strip() or "unknown"
+
+def main_benchmark(args):
+    stub = start_stub_server(latency_ms=args.latency_ms, jitter=args.jitter, error_rate=args.error_rate)
+    db_dir = tempfile.mkdtemp(prefix="weatherbot-bench-")
+    env = benchmark_env(stub.url, db_dir)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "cold_start": measure_cold_start(env) if not args.skip_cold_start else None,
+        "scenarios": {}
+    }
+
+    os.environ.update(env)
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    import main
+    queries = QueryCounter()
+    event.listen(Engine, "before_cursor_execute", queries)
+    main.app.config["API_DAILY_LIMITS"] = {provider: 10 ** 9 for provider in main.app.config["API_DAILY_LIMITS"]}      # Don't let the quota stop the benchmark.
+
+    cities = [f"benchcity{i}" for i in range(args.cities)]
+    def in_app_context(func):
+        def call(i):
+            with main.app.app_context():
+                func(i)
+        return call
+
+    clients = threading.local()         # One test client (and so one chat session) per benchmark thread.
+    def client():
+        if not hasattr(clients, "client"):
+            clients.client = main.app.test_client()
+        return clients.client
+    # The test client returns error responses rather than raising, so turn them into exceptions for run_scenario to count.
+    def checked(response):
+        if response.status_code >= 400:
+            raise AssertionError(f"HTTP {response.status_code} from {response.request.path}")
+        return response
+    messages = ["weather in {city}", "5 day forecast for {city}", "attractions in {city}", "hello, how are you?"]
+    def chat_message(i):
+        return messages[i % len(messages)].format(city=cities[i % len(cities)])
+    def map_url(i):             # Signed, as the app's own pages link to it.
+        with main.app.test_request_context():
+            return main.static_map_url(*main.geocode_city(cities[i % len(cities)]))
+
+    scenarios = {
+        "fetch_weather": in_app_context(lambda i: main.fetch_weather(cities[i % len(cities)])),
+        "fetch_5day_forecast": in_app_context(lambda i: main.fetch_5day_forecast(cities[i % len(cities)])),
+        "fetch_attractions": in_app_context(lambda i: main.fetch_attractions(*main.geocode_city(cities[i % len(cities)]))),
+        "home": lambda i: checked(client().post("/", data={"user_input": chat_message(i)})),
+        "api_chat": lambda i: checked(client().post("/api/chat", json={"message": chat_message(i)})),
+        "static_map": lambda i: checked(client().get(map_url(i)))
+    }
+    for name, func in scenarios.items():
+        if args.scenarios and name not in args.scenarios:
+            continue
+        main.geocode_memory.clear()         # Each scenario starts with cold in-memory caches (the database is kept).
+        main.weather_memory.clear()
+        main.attractions_memory.clear()
+        results["scenarios"][name] = run_scenario(func, args.iterations, args.concurrency, stub, queries)
+
+    stub.shutdown()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the weather chatbot against local stub providers.")
+    parser.add_argument("--iterations", type=int, default=100, help="Calls per scenario.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Threads making calls at the same time.")
+    parser.add_argument("--cities", type=int, default=20, help="Number of different cities to ask about (fewer means more cache hits).")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Average latency of the stub providers.")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Standard deviation of the stub latency, as a fraction of it.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests that fail with HTTP 500.")
+    parser.add_argument("--scenarios", nargs="*", help="Only run these scenarios.")
+    parser.add_argument("--skip-cold-start", action="store_true", help="Don't measure start-up time.")
+    parser.add_argument("--output", help="Where to save the JSON results (default: benchmarks/results/<commit>.json).")
+    args = parser.parse_args()
+
+    results = main_benchmark(args)
+    output = args.output or os.path.join(benchmarks_path, "results", f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    for name, result in results["scenarios"].items():
+        print(f"{name:20} {result['throughput_per_second']:>8} req/s  p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  "
+              f"{result['sql_queries_per_call']:>6} queries/call  {sum(result['upstream_calls'].values()):>5} upstream calls  {result['errors']} errors")
+    if results["cold_start"]:
+        for run, result in results["cold_start"].items():
+            print(f"cold start ({run}): {result}")
+    print(f"Results saved to {output}")
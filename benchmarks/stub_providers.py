@@ -0,0 +1,145 @@
+import json, math, random, time, hashlib, threading, argparse
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-ins for the OpenWeatherMap geo/weather/forecast endpoints, the Geoapify places endpoint and Google Static Maps, so the app can be benchmarked
+# without a network connection or spending API quota. Responses have the same shape as the real APIs, with configurable latency and error rate.
+# Point the app at it with OPENWEATHER_URL, GEOAPIFY_URL and GOOGLE_MAPS_URL (run_benchmark.py does this for you).
+
+# Cities whose names start with this aren't "found" by the geocoder, to exercise the not-found path.
+unknown_city_prefix = "nowhere"
+
+# Made-up but repeatable coordinates for a city name.
+def city_coords(city):
+    digest = hashlib.sha256(city.lower().encode()).digest()
+    return round(digest[0] / 255 * 140 - 70, 4), round(digest[1] / 255 * 360 - 180, 4)
+
+def geocode_response(query):
+    city = query.get("q", [""])[0]
+    if city.lower().startswith(unknown_city_prefix):
+        return []
+    lat, lon = city_coords(city)
+    return [{"name": city, "lat": lat, "lon": lon, "country": "AU"}]
+
+def weather_response(query):
+    return {
+        "coord": {"lat": float(query["lat"][0]), "lon": float(query["lon"][0])},
+        "weather": [{"description": random.choice(["clear sky", "light rain", "broken clouds"])}],
+        "main": {"temp": round(random.uniform(275, 305), 2), "humidity": random.randint(20, 95)},
+        "wind": {"speed": round(random.uniform(0, 12), 1)},
+        "name": "Stub City"
+    }
+
+def forecast_response(query):
+    start = int(time.time()) // 10800 * 10800           # Forecasts are every 3 hours, 40 entries (5 days).
+    entries = []
+    for i in range(40):
+        dt = start + i * 10800
+        entries.append({
+            "dt": dt,
+            "dt_txt": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(dt)),
+            "main": {"temp_max": round(random.uniform(275, 305), 2), "humidity": random.randint(20, 95)},
+            "weather": [{"description": random.choice(["clear sky", "light rain", "broken clouds"])}],
+            "wind": {"speed": round(random.uniform(0, 12), 1)}
+        })
+    return {"cod": "200", "cnt": len(entries), "list": entries}
+
+# Places scattered at random inside the requested circle ("circle:lon,lat,radius_in_metres").
+# Places found in any one search, like a town with a few sights. Tests raise it to the request's limit to make every area look dense.
+sights_per_search = 20
+
+def places_response(query):
+    lon, lat, radius = (float(value) for value in query.get("filter", ["circle:0,0,5000"])[0].split(":")[1].split(","))
+    features = []
+    for i in range(min(int(query.get("limit", [5])[0]), sights_per_search)):
+        distance, angle = radius * math.sqrt(random.random()), random.uniform(0, 2 * math.pi)
+        place_lat = round(lat + distance * math.cos(angle) / 111320, 6)
+        place_lon = round(lon + distance * math.sin(angle) / (111320 * max(math.cos(math.radians(lat)), 0.01)), 6)
+        features.append({"type": "Feature", "properties": {"name": f"Stub Sight {i + 1}", "lat": place_lat, "lon": place_lon},
+                         "geometry": {"type": "Point", "coordinates": [place_lon, place_lat]}})
+    return {"type": "FeatureCollection", "features": features}
+
+# A 1x1 PNG with the centre in it, so each location gets a different image (and content hash).
+def static_map_response(query):
+    center = query.get("center", [""])[0].encode()
+    return b"\x89PNG\r\n\x1a\n" + hashlib.sha256(center).digest()
+
+routes = {
+    "/geo/1.0/direct": geocode_response,
+    "/data/2.5/weather": weather_response,
+    "/data/2.5/forecast": forecast_response,
+    "/v2/places": places_response,
+    "/maps/api/staticmap": static_map_response
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"           # Keep-alive, like the real APIs.
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server
+        if url.path == "/__stats":          # Request counts per endpoint, used by the benchmarks to count upstream calls.
+            with server.lock:
+                return self.send_json(200, dict(server.request_counts))
+        handler = routes.get(url.path)
+        if not handler:
+            return self.send_json(404, {"cod": 404, "message": "Not found"})
+        with server.lock:
+            server.request_counts[url.path] += 1
+        if server.latency:
+            time.sleep(max(0, random.gauss(server.latency, server.latency * server.jitter)))
+        if random.random() < server.error_rate:
+            return self.send_json(500, {"cod": 500, "message": "Stub error"})
+        self.send_json(200, handler(parse_qs(url.query)))
+
+    def send_json(self, status, data):
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "image/png" if isinstance(data, bytes) else "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):       # Keep benchmark output quiet.
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency_ms=0, jitter=0.1, error_rate=0.0):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.request_counts = Counter()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset_counts(self):
+        with self.lock:
+            self.request_counts.clear()
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.request_counts.values())
+
+# Start a stub server on a background thread and return it. Use server.url as the base URL and server.shutdown() to stop it.
+def start_stub_server(port=0, latency_ms=0, jitter=0.1, error_rate=0.0):
+    server = StubServer(port, latency_ms, jitter, error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run stub OpenWeatherMap/Geoapify servers for offline testing.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Average response time added to every request.")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Standard deviation of the latency, as a fraction of it.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500.")
+    args = parser.parse_args()
+    server = StubServer(args.port, args.latency_ms, args.jitter, args.error_rate)
+    print(f"Stub providers listening on {server.url} (set OPENWEATHER_URL, GEOAPIFY_URL and GOOGLE_MAPS_URL to this)")
+    server.serve_forever()
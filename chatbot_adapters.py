@@ -0,0 +1,88 @@
+import re, heapq, threading
+from collections import defaultdict
+from difflib import SequenceMatcher
+from chatterbot.logic import LogicAdapter
+from chatterbot.conversation import Statement
+
+# ChatterBot loads logic adapters by import path, so this lives in its own module rather than main.py (importing main.py again would start a second copy of the app).
+
+word_pattern = re.compile(r"[a-z0-9']+")
+
+# Split text into the tokens used by the index: lower-case words plus pairs of neighbouring words (bigrams).
+def tokenize(text):
+    words = word_pattern.findall(text.lower())
+    return set(words) | {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+# Same similarity score as ChatterBot's LevenshteinDistance comparison, so confidence values mean the same thing as with the default BestMatch adapter.
+def similarity(text, other_text):
+    if not text or not other_text:
+        return 0
+    return round(SequenceMatcher(None, text.lower(), other_text.lower()).ratio(), 2)
+
+# Replacement for ChatterBot's BestMatch adapter. BestMatch compares the input with every stored statement, so it gets slower as the bot learns.
+# This keeps an in-memory inverted index (token -> statements that have a known response), shortlists the statements sharing the most (and rarest)
+# tokens with the input, and only scores that shortlist. The index is built on first use and then topped up with statements stored since.
+# Pass training_version, a function returning something that changes whenever the bot is retrained, to have the index rebuilt after a retrain.
+class IndexedBestMatch(LogicAdapter):
+
+    def __init__(self, chatbot, **kwargs):
+        super().__init__(chatbot, **kwargs)
+        self.max_candidates = kwargs.get("max_candidates", 50)        # Number of shortlisted statements that are actually scored.
+        self.training_version = kwargs.get("training_version")
+        self.lock = threading.Lock()
+        self.indexed_version = None             # training_version() when the index was started.
+        self.last_id = 0                        # Highest statement id that has been indexed.
+        self.responses = {}                     # Statement text -> texts of the responses to it.
+        self.index = defaultdict(set)           # Token -> statement texts containing it.
+
+    # Index statements stored since the last refresh (all of them the first time). Statement ids only increase, so this is a cheap primary key range query.
+    # Retraining deletes every statement and (in SQLite) starts the ids again from 1, so then the index is started again from scratch.
+    def refresh_index(self):
+        if self.training_version:
+            version = self.training_version()
+            if version != self.indexed_version:
+                self.indexed_version, self.last_id, self.responses, self.index = version, 0, {}, defaultdict(set)
+        StatementModel = self.chatbot.storage.get_model("statement")
+        session = self.chatbot.storage.Session()
+        try:
+            rows = session.query(StatementModel.id, StatementModel.text, StatementModel.in_response_to).filter(StatementModel.id > self.last_id).order_by(StatementModel.id).all()
+        finally:
+            session.close()
+        for statement_id, text, in_response_to in rows:
+            if in_response_to:
+                if in_response_to not in self.responses:
+                    self.responses[in_response_to] = []
+                    for token in tokenize(in_response_to):
+                        self.index[token].add(in_response_to)
+                self.responses[in_response_to].append(text)
+            self.last_id = statement_id
+
+    # Return the known statements most likely to match the input, ranked by shared tokens weighted by how rare each token is.
+    def shortlist(self, text):
+        scores = defaultdict(float)
+        for token in tokenize(text):
+            matches = self.index.get(token)
+            if matches:
+                weight = 1.0 / len(matches)
+                for match in matches:
+                    scores[match] += weight
+        return heapq.nlargest(self.max_candidates, scores, key=scores.get)
+
+    def process(self, input_statement, additional_response_selection_parameters=None):
+        with self.lock:
+            self.refresh_index()
+            closest_match, confidence = None, 0
+            for candidate in self.shortlist(input_statement.text):
+                candidate_confidence = similarity(input_statement.text, candidate)
+                if candidate_confidence > confidence:
+                    closest_match, confidence = candidate, candidate_confidence
+                if confidence >= self.maximum_similarity_threshold:         # Close enough, stop looking.
+                    break
+            response_texts = list(self.responses[closest_match]) if closest_match else []
+
+        if not response_texts:
+            return self.get_default_response(input_statement)
+        response_list = [Statement(text=text, in_response_to=closest_match) for text in response_texts]
+        response = self.select_response(input_statement, response_list, self.chatbot.storage)
+        response.confidence = confidence
+        return response
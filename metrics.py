@@ -0,0 +1,91 @@
+import time, bisect, threading
+from contextlib import contextmanager
+from flask import g, has_app_context
+
+# A small in-process metrics registry (counters and latency histograms), exported in Prometheus text format by the /metrics route in main.py.
+# Numbers are kept per worker process, so with several workers each one reports its own totals (Ref: Prometheus, 2024).
+
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)     # Histogram bucket upper bounds, in seconds.
+
+lock = threading.Lock()
+descriptions = {}       # Metric name -> (type, help text).
+counters = {}           # (name, labels) -> value.
+histograms = {}         # (name, labels) -> [count per bucket (last one is +Inf), sum, count].
+
+def describe(name, metric_type, help_text):
+    descriptions[name] = (metric_type, help_text)
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def inc(name, value=1, **labels):
+    key = (name, label_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    key = (name, label_key(labels))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(buckets, seconds)] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+# Add a timing to the current request's breakdown (see main.log_request_timings). The fanout pool's threads are given the request's list
+# (see main.run_in_app_context); anywhere else without one, e.g. background refreshes, this does nothing.
+def record_span(span, seconds):
+    if has_app_context() and "timings" in g:
+        g.timings.append((span, seconds))
+
+# Time a block of code into a histogram and the request's breakdown, e.g. "with timer("weatherbot_chatbot_seconds", span="chatbot"):".
+@contextmanager
+def timer(name, span=None, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(name, elapsed, **labels)
+        record_span(span or name, elapsed)
+
+# Total time and count per span name, e.g. "upstream=152.3ms/2 db_query=4.1ms/9".
+def summarise_spans(timings):
+    totals = {}
+    for span, seconds in timings:
+        total, count = totals.get(span, (0.0, 0))
+        totals[span] = (total + seconds, count + 1)
+    return " ".join(f"{span}={total * 1000:.1f}ms/{count}" for span, (total, count) in totals.items())
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [(key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+# Everything recorded so far, in the Prometheus text exposition format.
+def render_prometheus():
+    with lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in histograms.items())
+    lines = []
+    described = set()
+    def header(name, default_type):
+        if name not in described:
+            metric_type, help_text = descriptions.get(name, (default_type, ""))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            described.add(name)
+    for (name, labels), value in counter_items:
+        header(name, "counter")
+        lines.append(f"{name}{format_labels(labels)} {value}")
+    for (name, labels), (bucket_counts, total, count) in histogram_items:
+        header(name, "histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(list(buckets) + ["+Inf"], bucket_counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{name}_count{format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
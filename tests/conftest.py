@@ -0,0 +1,23 @@
+import os, sys, shutil, tempfile
+import pytest
+
+# Point the app at a throwaway database, lock directory and map cache before main.py is imported (it reads these at import time),
+# so the tests never touch the developer's weatherbot.sqlite3 and every run starts with empty caches.
+test_data_dir = tempfile.mkdtemp(prefix="weatherbot-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(test_data_dir, "weatherbot.sqlite3")
+os.environ["CHATBOT_DATABASE_URL"] = os.environ["DATABASE_URL"]
+os.environ["LOCK_DIR"] = os.path.join(test_data_dir, "locks")
+os.environ["MAP_CACHE_DIR"] = os.path.join(test_data_dir, "map_cache")
+
+# The benchmarks' stub providers, for tests that need the upstream APIs without calling the real ones.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+@pytest.fixture
+def stub():
+    from stub_providers import start_stub_server
+    server = start_stub_server()
+    yield server
+    server.shutdown()
+
+def pytest_unconfigure(config):
+    shutil.rmtree(test_data_dir, ignore_errors=True)
@@ -21,3 +21,333 @@ def test_fetch_attractions_valid_coords():
     data = fetch_attractions(51.5074, -0.1278)      # Using London coordinates for testing attractions.
     assert "features" in data                       # Confirm response includes 'features' key.
     assert isinstance(data["features"], list)
+
+def test_run_concurrently_partial_failure():
+    from main import run_concurrently
+    def fail():
+        raise ValueError("provider down")
+    results = run_concurrently([(lambda: "ok", (), None), (fail, (), {"error": "fallback"})])
+    assert results == ["ok", {"error": "fallback"}]     # One failed call shouldn't stop the other from returning.
+
+def test_run_concurrently_is_parallel():
+    import time
+    from main import run_concurrently
+    start = time.monotonic()
+    run_concurrently([(time.sleep, (0.3,), None), (time.sleep, (0.3,), None), (time.sleep, (0.3,), None)])
+    assert time.monotonic() - start < 0.8           # Three 0.3s calls should take about 0.3s, not 0.9s.
+
+def test_geocode_city_is_cached(monkeypatch):
+    import main
+    urls = []
+    class FakeResponse:
+        def json(self):
+            return []
+    def fake_get(provider, url):
+        urls.append(url)
+        return FakeResponse()
+    monkeypatch.setattr(main, "http_get", fake_get)
+    main.geocode_memory.clear()
+    assert main.geocode_city("ZiggyStardust") is None
+    main.geocode_memory.clear()                         # Force the lookup to go to the database rather than memory.
+    assert main.geocode_city("  zIGGYstardust ") is None
+    assert len(urls) == 1                               # "Not found" is cached, so the API is only called once.
+
+def test_fetch_5day_forecast_served_from_database(monkeypatch):
+    import main
+    class FakeResponse:
+        def json(self):
+            return {"list": [{"dt_txt": f"2030-01-0{day} 12:00:00", "main": {"temp_max": 290.15, "humidity": 60}, "weather": [{"description": "light rain"}], "wind": {"speed": 2.0}} for day in range(1, 6)]}
+    monkeypatch.setattr(main, "http_get", lambda provider, url: FakeResponse())
+    with main.app.app_context():
+        fetch_5day_forecast("Paris", lat=48.8566, lon=2.3522)      # Store a fresh forecast for Paris.
+    def no_network(provider, url):
+        raise AssertionError(f"Unexpected API call: {url}")
+    monkeypatch.setattr(main, "http_get", no_network)
+    with main.app.app_context():
+        forecast = fetch_5day_forecast("Paris")         # Second call within FORECAST_TTL comes from the database.
+    assert [entry["temp_max"] for entry in forecast["forecasts"]] == [17.0] * 5
+
+def test_fetch_weather_stale_while_revalidate(monkeypatch):
+    import time
+    import main
+    urls = []
+    class FakeResponse:
+        def json(self):
+            return {"main": {"temp": 293.15, "humidity": 60}, "weather": [{"description": "clear sky"}], "wind": {"speed": 1.0}}
+    def fake_get(provider, url):
+        urls.append(url)
+        return FakeResponse()
+    monkeypatch.setattr(main, "http_get", fake_get)
+    main.download_weather("Testville", lat=1.0, lon=2.0)
+    monkeypatch.setitem(main.app.config, "WEATHER_TTL", 0)         # Everything cached is now stale ...
+    stale_before = main.weather_cache_stats["stale"]
+    city, data = fetch_weather("Testville", lat=1.0, lon=2.0)
+    assert data["main"]["temp"] == 20.0                             # ... but is still returned straight away ...
+    assert main.weather_cache_stats["stale"] == stale_before + 1
+    time.sleep(0.5)
+    assert len(urls) == 2                                           # ... while a background refresh calls the API.
+
+def test_quota_limit_per_provider(monkeypatch):
+    import main
+    provider = "test"
+    monkeypatch.setitem(main.app.config["API_DAILY_LIMITS"], provider, 3)
+    monkeypatch.setitem(main.app.config, "QUOTA_LEASE_SIZE", 2)
+    for i in range(3):
+        main.charge_quota(provider)
+    with pytest.raises(main.QuotaExceeded):
+        main.charge_quota(provider)                     # Fourth call is over the daily limit of 3.
+    main.quota_leases.pop(provider, None)
+
+def test_quota_leases_under_contention_use_up_the_whole_limit(monkeypatch):
+    import threading, main
+    provider = "test-contention"
+    monkeypatch.setitem(main.app.config["API_DAILY_LIMITS"], provider, 45)
+    monkeypatch.setitem(main.app.config, "QUOTA_LEASE_SIZE", 20)
+    granted = []
+    def lease_until_refused():          # Like a worker process that keeps needing more calls.
+        with main.app.app_context():
+            while True:
+                lease = main.lease_quota(provider, "2000-01-01")
+                if not lease:
+                    return
+                granted.append(lease)
+    workers = [threading.Thread(target=lease_until_refused) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sum(granted) == 45           # Nobody is refused while calls are left, and no call is handed out twice.
+
+def test_chatbot_only_trained_when_training_data_changes(monkeypatch):
+    import main
+    assert main.training_fingerprint() == main.training_fingerprint() and len(main.training_fingerprint()) == 64
+    fingerprint, trained = ["ziggy-1"], []
+    def fake_train(bot):                # Records the training like train_chatbot does, without the slow part.
+        trained.append(fingerprint[0])
+        main.ChatbotTraining.query.delete()
+        main.db.session.add(main.ChatbotTraining(fingerprint=fingerprint[0]))
+        main.db.session.commit()
+    monkeypatch.setattr(main, "training_fingerprint", lambda: fingerprint[0])
+    monkeypatch.setattr(main, "train_chatbot", fake_train)
+    monkeypatch.setattr(main, "create_chatbot", lambda: object())
+    with main.app.app_context():
+        previous = [row.fingerprint for row in main.ChatbotTraining.query]
+        for new_fingerprint in ["ziggy-1", "ziggy-1", "ziggy-2"]:      # New data, same data again (e.g. a restarted worker), then changed data.
+            fingerprint[0] = new_fingerprint
+            monkeypatch.setattr(main, "chatbot", None)
+            assert main.get_chatbot() is not None
+        assert trained == ["ziggy-1", "ziggy-2"]
+        main.ChatbotTraining.query.delete()
+        main.db.session.add_all(main.ChatbotTraining(fingerprint=value) for value in previous)
+        main.db.session.commit()
+
+def test_route_message():
+    from main import route_message
+    assert route_message("5 day forecast for paris?") == ("forecast", "paris")
+    assert route_message("what's the weather forecast in melbourne") == ("weather", "melbourne")
+    assert route_message("things to do") == ("attractions", None)       # No city given, so the current map city is used.
+    assert route_message("hello there") == (None, None)                 # Small talk goes to the chatbot.
+
+def test_chatbot_adapter_tokenize():
+    from chatbot_adapters import tokenize, similarity
+    assert tokenize("How are you?") == {"how", "are", "you", "how are", "are you"}
+    assert similarity("Hello", "hello") == 1.0          # Same 0-1 scale as ChatterBot's LevenshteinDistance.
+
+def test_chatbot_adapter_answers_from_its_index(tmp_path):
+    from chatterbot import ChatBot
+    from chatterbot.trainers import ListTrainer
+    bot = ChatBot("ZiggyBot", logic_adapters=["chatbot_adapters.IndexedBestMatch"], database_uri=f"sqlite:///{tmp_path / 'bot.sqlite3'}",
+                  default_response="I don't know.", read_only=True)
+    adapter = bot.logic_adapters[0]
+    ListTrainer(bot).train(["hello there", "hi, how are you?"])
+    response = bot.get_response("hello there")
+    assert str(response) == "hi, how are you?" and response.confidence == 1.0
+    assert adapter.shortlist("well hello") == ["hello there"]
+    response = bot.get_response("zzzz")                             # Shares no tokens with anything known.
+    assert str(response) == "I don't know." and response.confidence == 0
+    ListTrainer(bot).train(["what is your name", "WeatherBot"])     # Statements stored after the index was built are added on the next message.
+    assert str(bot.get_response("what is your name?")) == "WeatherBot"
+
+def test_chatbot_adapter_rebuilds_its_index_after_retraining(tmp_path):
+    from chatterbot import ChatBot
+    from chatterbot.trainers import ListTrainer
+    version = [1]
+    bot = ChatBot("ZiggyBot", logic_adapters=["chatbot_adapters.IndexedBestMatch"], database_uri=f"sqlite:///{tmp_path / 'bot.sqlite3'}",
+                  default_response="I don't know.", read_only=True, training_version=lambda: version[0])
+    ListTrainer(bot).train(["hello there", "hi, how are you?", "what is your name", "WeatherBot"])
+    assert str(bot.get_response("hello there")) == "hi, how are you?"
+    bot.storage.drop()                  # As train_chatbot does. SQLite hands out the same ids again, below the highest one already indexed.
+    ListTrainer(bot).train(["hello there", "good day!"])
+    version[0] = 2
+    assert str(bot.get_response("hello there")) == "good day!"
+    assert str(bot.get_response("what is your name")) == "I don't know."      # Nothing left over from the old training.
+
+def test_chat_history_is_per_session(monkeypatch):
+    import main
+    monkeypatch.setattr(main, "get_bot_response", lambda user_input: "Hi!")
+    first, second = main.app.test_client(), main.app.test_client()     # Two browsers with their own session cookies.
+    reply = first.post("/api/chat", json={"message": "hello"}).get_json()
+    assert reply["user"] == "hello" and reply["bot"] == "Hi!"
+    assert len(first.get("/api/history").get_json()["messages"]) == 1
+    assert second.get("/api/history").get_json()["messages"] == []
+    assert first.post("/api/chat", json={}).status_code == 400
+    assert first.post("/api/chat", json=[1]).status_code == 400
+    assert first.post("/api/chat", json={"message": 5}).status_code == 400
+
+def test_history_pages_keep_messages_with_the_same_timestamp():
+    import main
+    from datetime import datetime
+    with main.app.app_context():
+        same_time = datetime(2030, 1, 1, 12, 0, 0)
+        main.db.session.add_all([main.ChatHistory(session_id="ziggypages", user_message=f"message {i}", bot_response="ok", timestamp=same_time) for i in range(3)])
+        main.db.session.commit()
+        first_page, before = main.load_history("ziggypages", limit=2)
+        second_page, last = main.load_history("ziggypages", main.parse_history_cursor(before), limit=2)
+    assert [m["user"] for m in second_page + first_page] == ["message 0", "message 1", "message 2"] and last is None
+
+def test_fetch_weather_against_stub_provider(monkeypatch, stub):
+    import main
+    monkeypatch.setitem(main.app.config, "OPENWEATHER_URL", stub.url)      # Configurable base URL, so no real API is called.
+    city, data = fetch_weather("StubTown", lat=-37.8, lon=144.9)
+    assert "main" in data and -10 < data["main"]["temp"] < 50
+    assert stub.request_counts["/data/2.5/weather"] == 1
+
+def test_chat_turn_survives_a_failed_geocode(monkeypatch):
+    import socket, main
+    with socket.socket() as closed:             # A port nothing is listening on, so the connection is refused.
+        closed.bind(("127.0.0.1", 0))
+        port = closed.getsockname()[1]
+    monkeypatch.setitem(main.app.config, "OPENWEATHER_URL", f"http://127.0.0.1:{port}")
+    client = main.app.test_client()
+    for message in ["weather in ziggyrefused", "forecast for ziggyrefused", "attractions in ziggyrefused"]:
+        response = client.post("/api/chat", json={"message": message})
+        assert response.status_code == 200 and "can't look up that city" in response.get_json()["bot"]
+
+    class HTMLResponse:                         # e.g. a 502 page from a proxy in front of the API.
+        status_code = 502
+        def json(self):
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+    monkeypatch.setattr(main, "http_get", lambda provider, url: HTMLResponse())
+    response = client.post("/api/chat", json={"message": "weather in ziggybadgateway"})
+    assert response.status_code == 200 and "can't look up that city" in response.get_json()["bot"]
+    with main.app.app_context():
+        assert main.GeocodeCache.query.filter(main.GeocodeCache.city_key.in_(["ziggyrefused", "ziggybadgateway"])).count() == 0       # Failures aren't cached.
+
+def test_metrics_endpoint():
+    import main
+    client = main.app.test_client()
+    client.get("/api/history")
+    body = client.get("/metrics").get_data(as_text=True)
+    assert "# TYPE weatherbot_request_seconds histogram" in body
+    assert 'weatherbot_request_seconds_count{endpoint="api_history",method="GET",status="200"}' in body
+
+def test_static_map_proxy_caches_and_revalidates(monkeypatch, tmp_path, stub):
+    import main
+    monkeypatch.setitem(main.app.config, "GOOGLE_MAPS_URL", stub.url)
+    monkeypatch.setitem(main.app.config, "MAP_CACHE_DIR", str(tmp_path))
+    client = main.app.test_client()
+    with main.app.test_request_context():
+        url, nearby_url = main.static_map_url(-37.81361, 144.96305), main.static_map_url(-37.8136, 144.9631)      # Same location once rounded.
+    first = client.get(url)
+    assert first.status_code == 200 and first.mimetype == "image/png" and first.headers["ETag"]
+    again = client.get(nearby_url, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert stub.request_counts["/maps/api/staticmap"] == 1
+    assert client.get("/map/100,0").status_code == 404
+    assert client.get("/map/-37.8136,144.9631").status_code == 403                          # Unsigned, or signed for somewhere else.
+    assert client.get(url.replace("144.9631", "144.9632")).status_code == 403
+    assert stub.request_counts["/maps/api/staticmap"] == 1
+
+def test_static_map_proxy_reports_unreachable_provider(monkeypatch, tmp_path):
+    import socket, main
+    with socket.socket() as closed:
+        closed.bind(("127.0.0.1", 0))
+        port = closed.getsockname()[1]
+    monkeypatch.setitem(main.app.config, "GOOGLE_MAPS_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setitem(main.app.config, "MAP_CACHE_DIR", str(tmp_path))
+    with main.app.test_request_context():
+        url = main.static_map_url(1, 2)
+    response = main.app.test_client().get(url)
+    assert response.status_code == 502 and "could not be reached" in response.get_data(as_text=True)
+
+def test_attractions_cached_by_grid_cell(monkeypatch, stub):
+    import main
+    monkeypatch.setitem(main.app.config, "GEOAPIFY_URL", stub.url)
+    with main.app.app_context():
+        main.attractions_memory.clear()
+        first = main.fetch_attractions(-37.8136, 144.9631)
+        main.attractions_memory.clear()                 # Second lookup is a nearby point in the same cell, served from the database.
+        second = main.fetch_attractions(-37.8101, 144.9622)
+    assert first["features"] and second["features"]
+    assert all(main.distance_m(-37.8101, 144.9622, *main.feature_coords(f)) <= 5000 for f in second["features"])
+    assert stub.request_counts["/v2/places"] == 1
+
+def test_attractions_in_a_dense_cell_looked_up_per_location(monkeypatch, stub):
+    import main, stub_providers
+    monkeypatch.setitem(main.app.config, "GEOAPIFY_URL", stub.url)
+    monkeypatch.setattr(stub_providers, "sights_per_search", 10 ** 6)        # Every search is full, so the cell's list would be cut short.
+    with main.app.app_context():
+        main.attractions_memory.clear()
+        first = main.fetch_attractions(-33.8688, 151.2093)
+        main.attractions_memory.clear()
+        again = main.fetch_attractions(-33.8688, 151.2093)         # Cell and location both come from the database.
+        other = main.fetch_attractions(-33.8601, 151.2152)          # Another location in the cell only needs its own lookup.
+    assert first["features"] == again["features"] and len(first["features"]) == 5 and other["features"]
+    assert all(main.distance_m(-33.8601, 151.2152, *main.feature_coords(f)) <= 5000 for f in other["features"])
+    assert stub.request_counts["/v2/places"] == 3
+
+def test_single_flight_coalesces_concurrent_calls(tmp_path, monkeypatch):
+    import time, threading, main
+    monkeypatch.setitem(main.app.config, "LOCK_DIR", str(tmp_path))
+    calls = []
+    def slow_lookup():
+        calls.append(1)
+        time.sleep(0.2)
+        return ("result", len(calls))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(main.single_flight.do(("test", "ziggystardust"), slow_lookup))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and results == [("result", 1)] * 8         # One call, shared by every concurrent caller.
+    assert main.single_flight.do(("test", "ziggystardust"), slow_lookup) == ("result", 2)      # Results aren't cached once the flight has landed.
+
+def test_prune_database_keeps_only_useful_rows(monkeypatch, tmp_path):
+    import os, main
+    from datetime import timedelta
+    monkeypatch.setitem(main.app.config, "LOCK_DIR", str(tmp_path))
+    monkeypatch.setitem(main.app.config, "MAP_CACHE_DIR", str(tmp_path / "map_cache"))
+    for key in ["old", "held", "recent"]:
+        with main.file_lock(("ziggyprune", key)):
+            pass
+    old, held, recent = (main.lock_file_path(("ziggyprune", key)) for key in ["old", "held", "recent"])
+    for path in [old, held]:
+        os.utime(path, (0, 0))
+    with main.app.app_context(), open(held, "a") as held_file:
+        main.fcntl.flock(held_file, main.fcntl.LOCK_EX)             # Another process is using this one.
+        assert main.db.session.execute("PRAGMA journal_mode").scalar() == "wal"
+        now = main.utc_now()
+        main.db.session.add(main.WeatherData(city="ziggyprune", date="2000-01-01", temperature=20, humidity=50, description="clear sky", fetched_at=now - timedelta(days=9000)))
+        main.db.session.add(main.ForecastData(city="ziggyprune", forecast_dt="2000-01-01 00:00:00", humidity=50, description="clear sky", fetched_at=now - timedelta(days=1)))
+        main.db.session.add(main.ForecastData(city="ziggyprune", forecast_dt="2999-01-01 00:00:00", humidity=50, description="clear sky", fetched_at=now))
+        main.db.session.commit()
+        deleted = main.prune_database()
+        assert deleted == {"weather_data": 1, "forecast_data": 1, "attractions_cache": 0, "lock_files": 1, "map_images": 0}
+        assert not os.path.exists(old) and os.path.exists(held) and os.path.exists(recent)      # Only the old lock nobody holds is deleted.
+        assert main.WeatherData.query.filter_by(city="ziggyprune").count() == 0
+        assert [row.forecast_dt for row in main.ForecastData.query.filter_by(city="ziggyprune")] == ["2999-01-01 00:00:00"]     # Still fresh, so kept.
+
+def test_prune_map_cache_keeps_images_in_use(monkeypatch, tmp_path):
+    import os, main
+    monkeypatch.setitem(main.app.config, "MAP_CACHE_DIR", str(tmp_path))
+    (old_key, blob_dir), (read_key, _) = main.map_cache_paths(1, 2, 14, "600x300"), main.map_cache_paths(3, 4, 14, "600x300")
+    for key_path, content_hash in [(old_key, "a"), (read_key, "b")]:
+        main.write_file_atomically(key_path, content_hash.encode())
+    for content_hash in ["a", "b", "c", "d"]:            # c and d belong to no key, and d was only just downloaded.
+        main.write_file_atomically(os.path.join(blob_dir, f"{content_hash}.png"), b"png")
+    for path in [old_key, read_key] + [os.path.join(blob_dir, f"{content_hash}.png") for content_hash in "abc"]:
+        os.utime(path, (0, 0))
+    assert main.cached_map_image(read_key, blob_dir)             # Reading an image keeps it.
+    assert main.prune_map_cache() == 2
+    assert sorted(os.listdir(blob_dir)) == ["b.png", "d.png"] and os.listdir(os.path.dirname(old_key)) == [os.path.basename(read_key)]